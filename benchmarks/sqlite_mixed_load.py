@@ -0,0 +1,138 @@
+'''
+    Смешанная нагрузка чтение/запись на SQLite: настройки по умолчанию против SQLITE_TUNED
+
+    Нагрузка идет прямо в DBManager из потоков, HTTP слой (FastAPI, event loop,
+    asyncio.to_thread для записей) не участвует - это замер БД, а не API.
+
+    python benchmarks/sqlite_mixed_load.py --cameras 50 --zones-per-camera 40 --readers 8 --writers 4 --duration 10
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from db_manager.db_manager import DBManager
+from api.models import Point
+
+
+def seed(db, cameras, zones_per_camera):
+    points = [
+        Point(latitude=55.75 + i * 0.00001, longitude=37.61 + (i % 2) * 0.00001, x=i, y=i * 2)
+        for i in range(4)
+    ]
+
+    zone_ids = []
+    for camera_number in range(cameras):
+        camera_id = db.create_camera({
+            "title": f"camera-{camera_number}",
+            "latitude": 55.75,
+            "longitude": 37.61,
+            "source": "rtsp://example",
+            "image_width": 1920,
+            "image_height": 1080,
+            "calib": None
+        })
+
+        for _ in range(zones_per_camera):
+            zone_ids.append(db.create_zone({
+                "zone_type": "standard",
+                "parking_lots_count": 10,
+                "camera_id": camera_id,
+                "pay": 0,
+                "points": points
+            }))
+
+    return zone_ids
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(sqlite_tuned, args):
+    with tempfile.TemporaryDirectory(prefix="parktrack-bench-") as directory:
+        return _run(os.path.join(directory, "bench.db"), sqlite_tuned, args)
+
+
+def _run(path, sqlite_tuned, args):
+    db = DBManager(f"sqlite:///{path}", sqlite_tuned=sqlite_tuned)
+    db.engine.echo = False
+
+    zone_ids = seed(db, args.cameras, args.zones_per_camera)
+
+    latencies = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(kind):
+        rng = random.Random()
+        local_latencies, local_errors = [], 0
+
+        while time.perf_counter() < deadline:
+            started_at = time.perf_counter()
+            try:
+                if kind == "write":
+                    db.update_zone(rng.choice(zone_ids), {"occupied": rng.randint(0, 10), "confidence": rng.random()})
+                elif rng.random() < 0.5:
+                    db.get_all_zones(rng.randint(1, args.cameras), None, None)
+                else:
+                    db.get_zone(rng.choice(zone_ids))
+                local_latencies.append(time.perf_counter() - started_at)
+            except Exception:
+                local_errors += 1
+
+        with lock:
+            latencies[kind].extend(local_latencies)
+            errors[kind] += local_errors
+
+    threads = [threading.Thread(target=worker, args=("read",)) for _ in range(args.readers)]
+    threads += [threading.Thread(target=worker, args=("write",)) for _ in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db.engine.dispose()
+
+    return {
+        kind: {
+            "ops_per_second": len(latencies[kind]) / args.duration,
+            "p50_ms": percentile(latencies[kind], 0.5) * 1000,
+            "p99_ms": percentile(latencies[kind], 0.99) * 1000,
+            "errors": errors[kind]
+        }
+        for kind in ("read", "write")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cameras", type=int, default=50)
+    parser.add_argument("--zones-per-camera", type=int, default=40)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    results = {mode: run(mode == "tuned", args) for mode in ("default", "tuned")}
+
+    print(f"{'mode':<8} {'kind':<6} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+    for mode, result in results.items():
+        for kind, stats in result.items():
+            print(
+                f"{mode:<8} {kind:<6} {stats['ops_per_second']:>10.1f} "
+                f"{stats['p50_ms']:>10.2f} {stats['p99_ms']:>10.2f} {stats['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
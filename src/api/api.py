@@ -1,8 +1,18 @@
-from fastapi import FastAPI, HTTPException, status, Request
+from fastapi import FastAPI, HTTPException, status, Request, Query
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+from datetime import timedelta
+from typing import List, Optional
 
-from .models import CreateCamera, CreateZone
+from .models import CreateCamera, CreateZone, UpdateCamera, UpdateZone
+from .background import PeriodicTask, StalenessSweeper
+from .snapshots import SnapshotCache
+from .tiles import TileCache, tile_exists, tile_bounds, zones_for_tile, zones_to_feature_collection
+from .profiling import ProfilingMiddleware, install_sql_timing, run_in_thread
+from .work_packages import WorkPackageCache
+from db_manager.db_manager import OccupancyExceedsCapacity, CameraTitleTaken, CameraNotFound
 
 import json
 
@@ -18,13 +28,39 @@ class PublicAPI:
     # Обязательно подключу когда-нибудь
     # valid_tokens = set() 
 
-    def __init__(self, db_manager):
+    def __init__(
+            self, 
+            db_manager, 
+            sweep_interval: timedelta = timedelta(minutes=1),
+            profiling_token: Optional[str] = None,
+            profiling_dir: str = "profiles",
+            export_dir: Optional[str] = None,
+            export_interval: timedelta = timedelta(minutes=15),
+            export_format: str = "arrow"):
         self.db_manager = db_manager
+        self.snapshots = SnapshotCache()
+        self.tiles = TileCache()
+        self.work_packages = WorkPackageCache()
+
+        self.background_tasks = []
+        if db_manager.stale_after is not None:
+            self.staleness_sweeper = StalenessSweeper(db_manager)
+            self.background_tasks.append(
+                PeriodicTask("staleness-sweeper", sweep_interval, self._sweep_stale_data))
+
+        self.export_dir = export_dir
+        self.export_format = export_format
+        if export_dir is not None:
+            # Без pyarrow или с неизвестным форматом сервер не стартует, а не пишет ошибку раз в interval
+            self.db_manager.check_columnar_export(export_format)
+            self.background_tasks.append(
+                PeriodicTask("columnar-export", export_interval, self._export_columnar_snapshot))
 
         self.app = FastAPI(
             title=self.title,
             version=self.version,
-            description=self.description
+            description=self.description,
+            lifespan=self._lifespan
         )
         self.app.add_middleware(
             CORSMiddleware,
@@ -37,13 +73,68 @@ class PublicAPI:
             allow_headers=["*"],
             allow_credentials=True,
         )
+
+        # Без токена middleware не подключается и ничего не стоит
+        if profiling_token:
+            install_sql_timing(self.db_manager.engine)
+            self.app.add_middleware(
+                ProfilingMiddleware,
+                token=profiling_token,
+                output_dir=profiling_dir
+            )
+
         self._setup_routes()
 
     def run(self, listen_on: URL):
         import uvicorn
         uvicorn.run(self.app, host=listen_on.host, port=listen_on.port)
 
+    @asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        for task in self.background_tasks:
+            task.start()
+
+        yield
+
+        for task in self.background_tasks:
+            await task.stop()
+
+    async def _sweep_stale_data(self):
+        result = await self.staleness_sweeper.sweep()
+
+        if result["stale_zone_ids"]:
+            self.snapshots.invalidate("zones")
+            for zone_id in result["stale_zone_ids"]:
+                self.tiles.invalidate_zone(zone_id)
+
+        if result["deactivated_cameras"] or result["reactivated_cameras"]:
+            self.snapshots.invalidate("cameras")
+
+    async def _export_columnar_snapshot(self):
+        path = await asyncio.to_thread(
+            self.db_manager.export_columnar_snapshot,
+            self.export_dir,
+            self.export_format)
+
+        print(f"Columnar snapshot exported: {path}")
+
+    def _work_package_response(self, camera_id: int, known_hash: List[str]):
+        package = self.work_packages.get_or_build(
+            camera_id,
+            lambda: self.db_manager.get_camera_work_package(camera_id))
+
+        if package is None:
+            return None
+
+        if package["hash"] in known_hash:
+            return {"camera_id": camera_id, "hash": package["hash"], "unchanged": True}
+
+        return package | {"unchanged": False}
+
     def _setup_routes(self):
+        # Записи уходят в потоки: в SQLite режиме они ждут очередь писателей в DBManager,
+        # и это ожидание не должно останавливать event loop. run_in_thread, а не asyncio.to_thread,
+        # чтобы работа в потоке попадала в профиль запроса
 
         @self.app.get("/health")
         async def get_health():
@@ -57,13 +148,7 @@ class PublicAPI:
         @self.app.post("/cameras/new")
         async def create_new_camera(new_camera: CreateCamera):
             try:
-                if self.db_manager.camera_title_already_exists(new_camera.title):
-                    raise HTTPException(
-                        status_code=status.HTTP_409_CONFLICT,
-                        detail=f"Camera with title '{new_camera.title}' already exists"
-                    )
-                
-                camera_id = self.db_manager.create_camera({
+                camera_id = await run_in_thread(self.db_manager.create_camera, {
                     "title": new_camera.title,
                     "latitude": new_camera.latitude,
                     "longitude": new_camera.longitude,
@@ -72,12 +157,18 @@ class PublicAPI:
                     "image_height": new_camera.image_height,
                     "calib": new_camera.calib
                 })
+                self.snapshots.invalidate("cameras")
                 
                 return {
                     "status": "success",
                     "message": "Camera created successfully",
                     "camera_id": camera_id
                 }
+            except CameraTitleTaken as e:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=str(e)
+                )
             except HTTPException:
                 raise
             except Exception as e:
@@ -89,23 +180,27 @@ class PublicAPI:
         @self.app.post('/zones/new')
         async def create_new_zone(new_zone: CreateZone):
             try:
-                if not self.db_manager.camera_id_exists(new_zone.camera_id):
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"Camera with id {new_zone.camera_id} doesn't exist"
-                    )
-                
-                zone_id = self.db_manager.create_zone({
+                zone_id = await run_in_thread(self.db_manager.create_zone, {
                     "zone_type": new_zone.zone_type,
                     "parking_lots_count": new_zone.capacity,
                     "camera_id": new_zone.camera_id,
                     "pay": new_zone.pay,
                     "points": new_zone.points
                 })
+                self.snapshots.invalidate("zones")
+                self.tiles.invalidate_zone(
+                    zone_id, 
+                    [(point.latitude, point.longitude) for point in new_zone.points])
+                self.work_packages.invalidate_camera(new_zone.camera_id)
 
                 return {
                     "zone_id": zone_id
                 }
+            except CameraNotFound as e:
+                raise HTTPException(
+                    status_code=404,
+                    detail=str(e)
+                )
             except HTTPException:
                 raise
             except Exception as e:
@@ -137,13 +232,17 @@ class PublicAPI:
             
         @self.app.get("/zones")
         async def get_zones(
+            request: Request,
             camera_id: int = None, 
             min_free_count: int = None, 
             max_pay: int = None):
             try:
-                zones = self.db_manager.get_all_zones(camera_id, min_free_count, max_pay)
+                zones = self.snapshots.get_or_build(
+                    "zones",
+                    (camera_id, min_free_count, max_pay),
+                    lambda: self.db_manager.get_all_zones(camera_id, min_free_count, max_pay))
                 
-                return zones
+                return zones.to_response(request)
 
             except HTTPException:
                 raise
@@ -155,20 +254,26 @@ class PublicAPI:
             
         @self.app.get("/cameras")
         async def get_cameras(
+            request: Request,
             q: str = None, 
             top_left_corner_latitude: float = None, 
             top_left_corner_longitude: float = None,
             bottom_right_corner_latitude: float = None,
             bottom_right_corner_longitude: float = None):
             try:
-                zones = self.db_manager.get_all_cameras(
+                filters = (
                     q, 
                     top_left_corner_latitude,
                     top_left_corner_longitude,
                     bottom_right_corner_latitude,
                     bottom_right_corner_longitude)
+
+                cameras = self.snapshots.get_or_build(
+                    "cameras",
+                    filters,
+                    lambda: self.db_manager.get_all_cameras(*filters))
                 
-                return zones
+                return cameras.to_response(request)
 
             except HTTPException:
                 raise
@@ -192,6 +297,42 @@ class PublicAPI:
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail=f"Internal server error: {str(e)}"
                 )
+
+        @self.app.get("/cameras/next/package")
+        async def get_next_camera_package(known_hash: List[str] = Query(default=[])):
+            try:
+                package = self._work_package_response(self.db_manager.next_camera_id(), known_hash)
+                
+                return package if package is not None else {}
+
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Internal server error: {str(e)}"
+                )
+
+        @self.app.get("/cameras/{camera_id}/package")
+        async def get_camera_package(camera_id: int, known_hash: List[str] = Query(default=[])):
+            try:
+                package = self._work_package_response(camera_id, known_hash)
+
+                if package is None:
+                    raise HTTPException(
+                        status_code=404,
+                        detail=f"Camera with id {camera_id} doesn't exist"
+                    )
+                
+                return package
+
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Internal server error: {str(e)}"
+                )
             
         @self.app.get("/cameras/{camera_id}")
         async def get_camera(camera_id: int):
@@ -209,10 +350,21 @@ class PublicAPI:
                 )
             
         @self.app.put("/cameras/{camera_id}")
-        async def update_camera(camera_id: int, updated_fields: Request):
+        async def update_camera(camera_id: int, updated_fields: UpdateCamera):
             try:
-                updated_fields = await updated_fields.json()
-                camera = self.db_manager.update_camera(camera_id, updated_fields)
+                camera = await run_in_thread(
+                    self.db_manager.update_camera,
+                    camera_id, 
+                    updated_fields.model_dump(exclude_unset=True))
+
+                if camera is None:
+                    raise HTTPException(
+                        status_code=404,
+                        detail=f"Camera with id {camera_id} doesn't exist"
+                    )
+
+                self.snapshots.invalidate("cameras")
+                self.work_packages.invalidate_camera(camera_id)
                 
                 return camera
 
@@ -225,13 +377,67 @@ class PublicAPI:
                 )
             
         @self.app.put("/zones/{zone_id}")
-        async def update_zone(zone_id: int, updated_fields: Request):
+        async def update_zone(zone_id: int, updated_fields: UpdateZone):
             try:
-                updated_fields = await updated_fields.json()
-                zone = self.db_manager.update_zone(zone_id, updated_fields)
+                try:
+                    zone = await run_in_thread(
+                        self.db_manager.update_zone, 
+                        zone_id, 
+                        updated_fields.to_db_fields())
+                except CameraNotFound as e:
+                    raise HTTPException(
+                        status_code=404,
+                        detail=str(e)
+                    )
+                except OccupancyExceedsCapacity as e:
+                    raise HTTPException(
+                        status_code=422,
+                        detail=str(e)
+                    )
+
+                if zone is None:
+                    raise HTTPException(
+                        status_code=404,
+                        detail=f"Zone with id {zone_id} doesn't exist"
+                    )
+
+                self.snapshots.invalidate("zones")
+                self.tiles.invalidate_zone(
+                    zone_id,
+                    [(point["latitude"], point["longitude"]) 
+                        for point in zone["points"] 
+                        if point["latitude"] is not None and point["longitude"] is not None])
+
+                if updated_fields.model_fields_set & {"camera_id", "zone_type", "capacity", "points"}:
+                    self.work_packages.invalidate_zone(zone_id, zone["camera_id"])
                 
                 return zone
 
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Internal server error: {str(e)}"
+                )
+
+        @self.app.get("/tiles/{z}/{x}/{y}")
+        async def get_tile(z: int, x: int, y: int, request: Request):
+            try:
+                if not tile_exists(z, x, y):
+                    raise HTTPException(
+                        status_code=404,
+                        detail=f"Tile {z}/{x}/{y} doesn't exist"
+                    )
+
+                def build_tile():
+                    zones = zones_for_tile(self.db_manager.get_zones_in_bbox(*tile_bounds(z, x, y)), z, x, y)
+                    return zones_to_feature_collection(zones, z), [zone["zone_id"] for zone in zones]
+
+                tile = self.tiles.get_or_build((z, x, y), build_tile)
+
+                return tile.to_response(request)
+
             except HTTPException:
                 raise
             except Exception as e:
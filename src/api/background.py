@@ -0,0 +1,66 @@
+import asyncio
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+
+
+class PeriodicTask:
+    """Фоновая задача, которая крутится в event loop API и вызывается раз в interval"""
+
+    def __init__(self, name: str, interval: timedelta, job: Callable[[], Awaitable[None]]):
+        self.name = name
+        self.interval = interval
+        self.job = job
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name=self.name)
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Упавший проход не должен убивать задачу, попробуем в следующий раз
+                print(f"Background task {self.name} failed: {e}")
+
+            await asyncio.sleep(self.interval.total_seconds())
+
+
+class StalenessSweeper:
+    """Находит зоны, чья занятость стала неизвестной, и выключает камеры без свежих данных"""
+
+    def __init__(self, db_manager, batch_size: int = 1000):
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+        self.last_cutoff = None
+
+    async def sweep(self):
+        # Запросы к БД синхронные, уводим их из event loop
+        result = await asyncio.to_thread(
+            self.db_manager.sweep_stale_zones,
+            self.last_cutoff,
+            self.batch_size)
+
+        self.last_cutoff = result["cutoff"]
+
+        if result["stale_zone_ids"] or result["deactivated_cameras"] or result["reactivated_cameras"]:
+            print(
+                f"Staleness sweep: {len(result['stale_zone_ids'])} zones became unknown, "
+                f"{result['deactivated_cameras']} cameras deactivated, "
+                f"{result['reactivated_cameras']} cameras reactivated")
+
+        return result
@@ -1,5 +1,5 @@
-from typing import List, Dict, TypedDict, Any
-from pydantic import BaseModel, field_validator
+from typing import List, Dict, TypedDict, Any, Optional
+from pydantic import BaseModel, ConfigDict, Field, AliasChoices, field_validator, model_validator
 import json
 
 class CreateCamera(BaseModel):
@@ -152,4 +152,134 @@ class CreateZone(BaseModel):
                 if points[lhs] == points[rhs]:
                     raise ValueError(f"Degenerate rectangle")
         
-        return points
\ No newline at end of file
+        return points
+
+class UpdateCamera(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    title: Optional[str] = None
+    source: Optional[str] = None
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    calib: Any = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    is_active: Optional[bool] = None
+
+    @field_validator('title', 'source', 'image_width', 'image_height', 'latitude', 'longitude', 'is_active')
+    @classmethod
+    def validate_not_null(cls, value, info):
+        if value is None:
+            raise ValueError(f"{info.field_name} can't be null")
+        return value
+
+    @field_validator('title')
+    @classmethod
+    def validate_title(cls, title):
+        return CreateCamera.validate_title(title)
+
+    @field_validator('latitude')
+    @classmethod
+    def validate_latitude(cls, latitude):
+        return CreateCamera.validate_latitude(latitude)
+
+    @field_validator('longitude')
+    @classmethod
+    def validate_longitude(cls, longitude):
+        return CreateCamera.validate_longitude(longitude)
+
+    @field_validator('image_width')
+    @classmethod
+    def validate_image_width(cls, image_width):
+        return CreateCamera.validate_image_width(image_width)
+
+    @field_validator('image_height')
+    @classmethod
+    def validate_image_height(cls, image_height):
+        return CreateCamera.validate_image_height(image_height)
+
+    @field_validator('calib')
+    @classmethod
+    def validate_calib(cls, calib):
+        return CreateCamera.validate_calib(calib)
+
+class UpdateZone(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    camera_id: Optional[int] = None
+    zone_type: Optional[str] = None
+    capacity: Optional[int] = Field(
+        default=None, 
+        validation_alias=AliasChoices('capacity', 'parking_lots_count'))
+    pay: Optional[int] = None
+    occupied: Optional[int] = None
+    confidence: Optional[float] = None
+    points: Optional[List[Point]] = None
+
+    # Сбросить занятость в неизвестную нельзя: это делает порог устаревания, а не детектор
+    @field_validator('camera_id', 'zone_type', 'capacity', 'pay', 'occupied', 'points')
+    @classmethod
+    def validate_not_null(cls, value, info):
+        if value is None:
+            raise ValueError(f"{info.field_name} can't be null")
+        return value
+
+    @field_validator('camera_id')
+    @classmethod
+    def validate_camera_id(cls, camera_id):
+        return CreateZone.validate_camera_id(camera_id)
+
+    @field_validator('zone_type')
+    @classmethod
+    def validate_zone_type(cls, zone_type):
+        return CreateZone.validate_zone_type(zone_type)
+
+    @field_validator('capacity')
+    @classmethod
+    def validate_capacity(cls, capacity):
+        return CreateZone.validate_capacity(capacity)
+
+    @field_validator('pay')
+    @classmethod
+    def validate_pay(cls, pay):
+        return CreateZone.validate_pay(pay)
+
+    @field_validator('occupied')
+    @classmethod
+    def validate_occupied(cls, occupied):
+        if occupied is not None and occupied < 0:
+            raise ValueError(f"Invalid occupied value: {occupied}")
+        
+        return occupied
+
+    @field_validator('confidence')
+    @classmethod
+    def validate_confidence(cls, confidence):
+        if confidence is not None and (confidence < 0 or confidence > 1):
+            raise ValueError(f"Invalid confidence value: {confidence}")
+        
+        return confidence
+
+    @field_validator('points')
+    @classmethod
+    def validate_points(cls, points):
+        return CreateZone.validate_points(points)
+
+    @model_validator(mode='after')
+    def validate_occupied_capacity(self):
+        if self.occupied is not None and self.capacity is not None and self.occupied > self.capacity:
+            raise ValueError(f"occupied ({self.occupied}) exceeds capacity ({self.capacity})")
+        
+        return self
+
+    def to_db_fields(self):
+        """Поля для UPDATE: только переданные клиентом, в именах колонок БД"""
+        fields = self.model_dump(exclude_unset=True, exclude={'points'})
+
+        if 'capacity' in fields:
+            fields['parking_lots_count'] = fields.pop('capacity')
+
+        if 'points' in self.model_fields_set:
+            fields['points'] = self.points
+
+        return fields
\ No newline at end of file
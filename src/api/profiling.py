@@ -0,0 +1,161 @@
+import asyncio
+import contextvars
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import time
+import uuid
+
+from sqlalchemy import event
+
+PROFILE_HEADER = b"x-profile-token"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+# Список запросов к БД профилируемого HTTP запроса, None - профилирование не идет
+_profiled_queries = contextvars.ContextVar("profiled_queries", default=None)
+# Профайлеры потоков, куда профилируемый HTTP запрос увел работу через run_in_thread
+_thread_profiles = contextvars.ContextVar("thread_profiles", default=None)
+
+
+def install_sql_timing(engine):
+    """Засекать время SQL запросов, выполненных во время профилирования"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _profiled_queries.get() is not None:
+            conn.info.setdefault("profiling_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries = _profiled_queries.get()
+        started_at = conn.info.get("profiling_started_at")
+        if queries is None or not started_at:
+            return
+
+        queries.append({
+            "statement": statement,
+            "executemany": executemany,
+            "duration_ms": (time.perf_counter() - started_at.pop()) * 1000
+        })
+
+
+async def run_in_thread(func, *args):
+    """asyncio.to_thread, работа в потоке которого попадает в профиль запроса"""
+    profiles = _thread_profiles.get()
+    if profiles is None:
+        return await asyncio.to_thread(func, *args)
+
+    return await asyncio.to_thread(_run_profiled, profiles, func, *args)
+
+
+def _run_profiled(profiles, func, *args):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # С Python 3.12 профайлер один на процесс и уже видит все потоки
+        return func(*args)
+
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        profiles.append(profiler)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: профилирует запрос, если в X-Profile-Token передан верный токен
+
+    Результат кладется в output_dir: <id>.prof (pstats, открывается в snakeviz,
+    flameprof строит из него flamegraph) и <id>.json с SQL запросами и их временем.
+    id возвращается в заголовке X-Profile-Id. cProfile снимает все, что выполняется
+    в потоке event loop, поэтому в дерево могут попасть соседние запросы. Работа,
+    которую обработчик увел в поток, видна только если он вызывал ее через run_in_thread
+    (голый asyncio.to_thread в профиле будет просто ожиданием).
+    """
+
+    def __init__(self, app, token: str, output_dir: str):
+        self.app = app
+        self.token = token.encode()
+        self.output_dir = output_dir
+        self._busy = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._busy or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self._busy = True
+        profile_id = uuid.uuid4().hex
+        response_status = None
+
+        async def send_with_profile_id(message):
+            nonlocal response_status
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER, profile_id.encode())
+                ]
+            await send(message)
+
+        queries = []
+        thread_profiles = []
+        token = _profiled_queries.set(queries)
+        thread_profiles_token = _thread_profiles.set(thread_profiles)
+        profiler = cProfile.Profile()
+        started_at = time.perf_counter()
+        try:
+            profiler.enable()
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.disable()
+            duration_ms = (time.perf_counter() - started_at) * 1000
+            _profiled_queries.reset(token)
+            _thread_profiles.reset(thread_profiles_token)
+            self._busy = False
+
+            try:
+                self._save(profile_id, scope, response_status, duration_ms, profiler, thread_profiles, queries)
+            except Exception as e:
+                print(f"Failed to save profile {profile_id}: {e}")
+
+    def _requested(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    def _save(self, profile_id, scope, response_status, duration_ms, profiler, thread_profiles, queries):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_path = os.path.join(self.output_dir, profile_id)
+
+        stats = pstats.Stats(profiler)
+        for thread_profiler in thread_profiles:
+            stats.add(thread_profiler)
+
+        stats.dump_stats(base_path + ".prof")
+
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:30]
+
+        with open(base_path + ".json", "w") as f:
+            json.dump({
+                "profile_id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query_string": scope["query_string"].decode(errors="replace"),
+                "status": response_status,
+                "duration_ms": duration_ms,
+                "sql_total_ms": sum(query["duration_ms"] for query in queries),
+                "sql": queries,
+                "top_cumulative": [
+                    {
+                        "function": f"{filename}:{line}({name})",
+                        "calls": calls,
+                        "total_ms": total_time * 1000,
+                        "cumulative_ms": cumulative_time * 1000
+                    }
+                    for (filename, line, name), (_, calls, total_time, cumulative_time, _) in top
+                ]
+            }, f, indent=2)
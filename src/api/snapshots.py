@@ -0,0 +1,136 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# В порядке предпочтения сервера при равных q
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# Маленькие тела сжимать невыгодно
+MIN_COMPRESS_SIZE = 1024
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """Выбрать кодировку ответа по заголовку Accept-Encoding"""
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+
+        weights[coding] = q
+
+    best, best_q = "identity", 0.0
+    for coding in SUPPORTED_ENCODINGS:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+
+    return best
+
+
+def render_json(content: Any) -> bytes:
+    """Сериализация как у JSONResponse"""
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class Snapshot:
+    """Готовое тело ответа и его сжатые варианты, которые считаются один раз"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self._encoded = {"identity": body}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding: str) -> bytes:
+        if len(self.body) < MIN_COMPRESS_SIZE:
+            return self.body
+
+        with self._lock:
+            if encoding not in self._encoded:
+                if encoding == "br":
+                    self._encoded[encoding] = brotli.compress(self.body, quality=5)
+                elif encoding == "gzip":
+                    self._encoded[encoding] = gzip.compress(self.body, compresslevel=6)
+                else:
+                    return self.body
+
+            return self._encoded[encoding]
+
+    def to_response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Vary": "Accept-Encoding"}
+
+        if request.headers.get("if-none-match") == self.etag:
+            return Response(status_code=304, headers=headers)
+
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+        body = self.encoded(encoding)
+        if body is not self.body:
+            headers["Content-Encoding"] = encoding
+
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+class SnapshotCache:
+    """LRU снапшотов списочных ответов, сбрасывается по пространствам имен ("zones", "cameras")"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get_or_build(self, namespace: str, key: Hashable, build: Callable[[], Any]) -> Snapshot:
+        cache_key = (namespace, key)
+
+        with self._lock:
+            snapshot = self._entries.get(cache_key)
+            if snapshot is not None:
+                self._entries.move_to_end(cache_key)
+                return snapshot
+
+            generation = self._generations.get(namespace, 0)
+
+        snapshot = Snapshot(render_json(build()))
+
+        with self._lock:
+            # Если данные поменялись пока строили снапшот, отдаем его, но не кэшируем
+            if self._generations.get(namespace, 0) == generation:
+                self._entries[cache_key] = snapshot
+                self._entries.move_to_end(cache_key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return snapshot
+
+    def invalidate(self, namespace: str):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            for cache_key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[cache_key]
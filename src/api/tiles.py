@@ -0,0 +1,193 @@
+import math
+import threading
+from collections import OrderedDict, Counter
+from typing import Any, Callable, Iterable, List, Tuple
+
+from .snapshots import Snapshot, render_json
+
+MAX_ZOOM = 22
+
+# Ниже этого зума зона отдается точкой в центроиде, а не полигоном
+POLYGON_MIN_ZOOM = 16
+
+
+def tile_exists(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(south, west, north, east) тайла в Web Mercator"""
+    n = 2 ** z
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return latitude(y + 1), x / n * 360.0 - 180.0, latitude(y), (x + 1) / n * 360.0 - 180.0
+
+
+def tile_for_point(z: int, latitude: float, longitude: float) -> Tuple[int, int]:
+    n = 2 ** z
+    latitude = max(min(latitude, 85.0511), -85.0511)
+
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bbox(z: int, south: float, west: float, north: float, east: float):
+    """Все тайлы зума z, которые пересекает прямоугольник"""
+    min_x, min_y = tile_for_point(z, north, west)
+    max_x, max_y = tile_for_point(z, south, east)
+
+    return [(z, x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def zone_centroid(zone: dict) -> Tuple[float, float]:
+    points = [
+        point for point in zone["points"]
+        if point["latitude"] is not None and point["longitude"] is not None
+    ]
+
+    return (
+        sum(point["latitude"] for point in points) / len(points),
+        sum(point["longitude"] for point in points) / len(points)
+    )
+
+
+def zones_for_tile(zones: List[dict], z: int, x: int, y: int) -> List[dict]:
+    """Отбросить зоны, которые на этом зуме отдаются точкой и принадлежат соседнему тайлу
+
+    Из БД приходят зоны, чей bbox пересекает тайл. Полигон рисуется во всех таких тайлах,
+    а точку-центроид отдает только тайл, в котором она лежит, иначе она задвоится.
+    """
+    zones = [
+        zone for zone in zones 
+        if any(point["latitude"] is not None and point["longitude"] is not None for point in zone["points"])
+    ]
+
+    if z >= POLYGON_MIN_ZOOM:
+        return zones
+
+    return [zone for zone in zones if tile_for_point(z, *zone_centroid(zone)) == (x, y)]
+
+
+def coordinate_precision(z: int) -> int:
+    """Сколько знаков после запятой различимо на экране при данном зуме (256px тайл)"""
+    return max(0, math.ceil(math.log10(2 ** z * 256 / 360)))
+
+
+def zones_to_feature_collection(zones: List[dict], z: int) -> dict:
+    """GeoJSON FeatureCollection из сериализованных зон, упрощенных под зум"""
+    precision = coordinate_precision(z)
+    features = []
+
+    for zone in zones:
+        ring = [
+            [round(point["longitude"], precision), round(point["latitude"], precision)]
+            for point in zone["points"]
+            if point["latitude"] is not None and point["longitude"] is not None
+        ]
+        if not ring:
+            continue
+
+        if z >= POLYGON_MIN_ZOOM:
+            geometry = {"type": "Polygon", "coordinates": [ring + [ring[0]]]}
+        else:
+            geometry = {
+                "type": "Point",
+                "coordinates": [
+                    round(sum(lon for lon, _ in ring) / len(ring), precision),
+                    round(sum(lat for _, lat in ring) / len(ring), precision)
+                ]
+            }
+
+        features.append({
+            "type": "Feature",
+            "id": zone["zone_id"],
+            "geometry": geometry,
+            "properties": {
+                "zone_id": zone["zone_id"],
+                "camera_id": zone["camera_id"],
+                "zone_type": zone["zone_type"],
+                "capacity": zone["capacity"],
+                "occupied": zone["occupied"],
+                "confidence": zone["confidence"],
+                "occupancy_status": zone["occupancy_status"],
+                "pay": zone["pay"],
+                "occupancy_updated_at": zone["occupancy_updated_at"]
+            }
+        })
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+class TileCache:
+    """LRU тайлов с обратным индексом зона -> тайлы для точечной инвалидации"""
+
+    def __init__(self, max_tiles: int = 4096):
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()
+        self._zone_tiles = {}
+        self._zooms = Counter()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_build(self, tile: Tuple[int, int, int], build: Callable[[], Tuple[Any, Iterable[int]]]) -> Snapshot:
+        with self._lock:
+            entry = self._tiles.get(tile)
+            if entry is not None:
+                self._tiles.move_to_end(tile)
+                return entry[0]
+
+            generation = self._generation
+
+        content, zone_ids = build()
+        snapshot = Snapshot(render_json(content))
+
+        with self._lock:
+            # Зоны поменялись пока строили тайл - не знаем, задело ли его, не кэшируем
+            if self._generation == generation and tile not in self._tiles:
+                zone_ids = frozenset(zone_ids)
+                self._tiles[tile] = (snapshot, zone_ids)
+                self._zooms[tile[0]] += 1
+                for zone_id in zone_ids:
+                    self._zone_tiles.setdefault(zone_id, set()).add(tile)
+
+                while len(self._tiles) > self.max_tiles:
+                    self._drop(next(iter(self._tiles)))
+
+        return snapshot
+
+    def invalidate_zone(self, zone_id: int, coordinates: Iterable[Tuple[float, float]] = ()):
+        """Сбросить тайлы, где зона была, и тайлы под bbox ее новых вершин (latitude, longitude)"""
+        coordinates = list(coordinates)
+
+        with self._lock:
+            self._generation += 1
+
+            affected = set(self._zone_tiles.get(zone_id, ()))
+            if coordinates:
+                latitudes = [latitude for latitude, _ in coordinates]
+                longitudes = [longitude for _, longitude in coordinates]
+                for z in self._zooms:
+                    affected.update(tiles_for_bbox(
+                        z, min(latitudes), min(longitudes), max(latitudes), max(longitudes)))
+
+            for tile in affected:
+                if tile in self._tiles:
+                    self._drop(tile)
+
+    def _drop(self, tile):
+        _, zone_ids = self._tiles.pop(tile)
+
+        self._zooms[tile[0]] -= 1
+        if not self._zooms[tile[0]]:
+            del self._zooms[tile[0]]
+
+        for zone_id in zone_ids:
+            tiles = self._zone_tiles.get(zone_id)
+            if tiles is not None:
+                tiles.discard(tile)
+                if not tiles:
+                    del self._zone_tiles[zone_id]
@@ -0,0 +1,58 @@
+import hashlib
+import threading
+from typing import Callable, Optional
+
+from .snapshots import render_json
+
+
+class WorkPackageCache:
+    """Рабочие пакеты детекторов (камера + геометрия зон) по camera_id
+
+    Хэш считается от содержимого пакета, так что детектор, у которого
+    пакет с таким хэшем уже есть, может не скачивать геометрию заново.
+    """
+
+    def __init__(self):
+        self._packages = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get_or_build(self, camera_id: int, build: Callable[[], Optional[dict]]) -> Optional[dict]:
+        with self._lock:
+            package = self._packages.get(camera_id)
+            if package is not None:
+                return package
+
+            generation = self._generations.get(camera_id, 0)
+
+        content = build()
+        if content is None:
+            return None
+
+        package = content | {
+            "camera_id": camera_id,
+            "hash": hashlib.sha256(render_json(content)).hexdigest()
+        }
+
+        with self._lock:
+            if self._generations.get(camera_id, 0) == generation:
+                self._packages[camera_id] = package
+
+        return package
+
+    def invalidate_camera(self, camera_id: int):
+        with self._lock:
+            self._generations[camera_id] = self._generations.get(camera_id, 0) + 1
+            self._packages.pop(camera_id, None)
+
+    def invalidate_zone(self, zone_id: int, camera_id: int):
+        """Сбросить пакет камеры зоны и пакет, где зона лежала раньше (если зону перевесили)"""
+        with self._lock:
+            camera_ids = {camera_id} | {
+                cached_camera_id
+                for cached_camera_id, package in self._packages.items()
+                if any(zone["zone_id"] == zone_id for zone in package["zones"])
+            }
+
+        for camera_id in camera_ids:
+            self.invalidate_camera(camera_id)
@@ -0,0 +1,193 @@
+'''
+    Колоночные снапшоты зон, их точек и текущей занятости для аналитики
+'''
+
+import os
+import re
+import shutil
+from datetime import datetime, timezone
+from typing import Dict
+
+from sqlalchemy import select, cast, Float
+
+from .models import ParkingZone, ParkingZonePoint
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = {"arrow": ".arrow", "parquet": ".parquet"}
+LATEST_FILE = "LATEST"
+
+# Имена папок снапшотов: datetime.strftime("%Y%m%dT%H%M%S%fZ")
+SNAPSHOT_NAME_FORMAT = "%Y%m%dT%H%M%S%fZ"
+SNAPSHOT_NAME_PATTERN = re.compile(r"\d{8}T\d{12}Z")
+
+
+def _tables():
+    """(имя файла, SELECT, схема) для каждой выгружаемой таблицы"""
+    utc_timestamp = pa.timestamp("us", tz="UTC")
+
+    zones = (
+        select(
+            ParkingZone.id,
+            ParkingZone.camera_id,
+            ParkingZone.zone_type,
+            ParkingZone.parking_lots_count,
+            ParkingZone.occupied,
+            ParkingZone.confidence,
+            ParkingZone.pay,
+            ParkingZone.occupancy_updated_at,
+            ParkingZone.created_at,
+            ParkingZone.updated_at)
+        .order_by(ParkingZone.id),
+        pa.schema([
+            ("zone_id", pa.int64()),
+            ("camera_id", pa.int64()),
+            ("zone_type", pa.string()),
+            ("capacity", pa.int32()),
+            ("occupied", pa.int32()),
+            ("confidence", pa.float64()),
+            ("pay", pa.int32()),
+            ("occupancy_updated_at", utc_timestamp),
+            ("created_at", utc_timestamp),
+            ("updated_at", utc_timestamp)
+        ])
+    )
+
+    # Numeric приводим к float в самой БД, чтобы не конвертировать Decimal построчно
+    points = (
+        select(
+            ParkingZonePoint.id,
+            ParkingZonePoint.parking_zone_id,
+            ParkingZonePoint.x,
+            ParkingZonePoint.y,
+            cast(ParkingZonePoint.latitude, Float),
+            cast(ParkingZonePoint.longitude, Float))
+        .order_by(ParkingZonePoint.parking_zone_id, ParkingZonePoint.id),
+        pa.schema([
+            ("point_id", pa.int64()),
+            ("zone_id", pa.int64()),
+            ("x", pa.int32()),
+            ("y", pa.int32()),
+            ("latitude", pa.float64()),
+            ("longitude", pa.float64())
+        ])
+    )
+
+    return [("zones", *zones), ("zone_points", *points)]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Columnar export requires pyarrow (pip install pyarrow)")
+
+
+def check_export_support(format: str):
+    """Упасть сразу, если выгрузку в format сделать не получится"""
+    _require_pyarrow()
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format: {format}")
+
+
+def export_snapshot(engine, directory: str, format: str = "arrow", batch_size: int = 50000, keep: int = 3) -> str:
+    """Выгрузить снапшот в directory/<timestamp>/ и вернуть путь к нему
+
+    Строки читаются пачками по batch_size и сразу перекладываются в колонки Arrow,
+    без промежуточных dict на каждую строку. Снапшот собирается во временной папке
+    и появляется атомарным переименованием, LATEST указывает на последний готовый.
+    """
+    check_export_support(format)
+
+    os.makedirs(directory, exist_ok=True)
+    name = datetime.now(timezone.utc).strftime(SNAPSHOT_NAME_FORMAT)
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    os.makedirs(tmp_path)
+
+    try:
+        with engine.connect() as connection:
+            # Зоны и точки читаем из одного снимка БД, иначе параллельная замена точек
+            # зоны (update_zone) может дать несогласованный снапшот
+            if engine.dialect.name == "postgresql":
+                connection = connection.execution_options(isolation_level="REPEATABLE READ")
+            elif engine.dialect.name == "sqlite":
+                # pysqlite не открывает транзакцию на SELECT, каждый запрос читал бы свой снимок.
+                # Писателей она не блокирует только в WAL, без него DBManager выгрузку не пускает
+                connection.exec_driver_sql("BEGIN")
+
+            for table_name, query, schema in _tables():
+                _write_table(
+                    connection.execution_options(yield_per=batch_size).execute(query),
+                    schema,
+                    os.path.join(tmp_path, table_name + FORMATS[format]),
+                    format)
+
+        snapshot_path = os.path.join(directory, name)
+        os.rename(tmp_path, snapshot_path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    latest_tmp = os.path.join(directory, LATEST_FILE + ".tmp")
+    with open(latest_tmp, "w") as f:
+        f.write(name)
+    os.replace(latest_tmp, os.path.join(directory, LATEST_FILE))
+
+    _remove_old_snapshots(directory, keep)
+
+    return snapshot_path
+
+
+def _write_table(result, schema, path: str, format: str):
+    if format == "parquet":
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+
+    try:
+        for rows in result.partitions():
+            columns = zip(*rows)
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema))
+    finally:
+        writer.close()
+
+
+def _remove_old_snapshots(directory: str, keep: int):
+    # Удаляем только то, что выгрузили сами: чужие папки в directory не трогаем
+    snapshots = sorted(
+        entry for entry in os.listdir(directory)
+        if SNAPSHOT_NAME_PATTERN.fullmatch(entry) and os.path.isdir(os.path.join(directory, entry))
+    )
+
+    for entry in snapshots[:-keep] if keep > 0 else []:
+        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+
+def open_snapshot(path: str) -> Dict[str, "pa.Table"]:
+    """Открыть снапшот (папку снапшота или папку выгрузки с LATEST) через memory map
+
+    Arrow IPC файлы читаются без копирования: таблицы ссылаются прямо на страницы файла.
+    """
+    _require_pyarrow()
+
+    latest = os.path.join(path, LATEST_FILE)
+    if os.path.exists(latest):
+        with open(latest) as f:
+            path = os.path.join(path, f.read().strip())
+
+    tables = {}
+    for entry in sorted(os.listdir(path)):
+        table_name, extension = os.path.splitext(entry)
+        file_path = os.path.join(path, entry)
+
+        if extension == FORMATS["arrow"]:
+            tables[table_name] = pa.ipc.open_file(pa.memory_map(file_path, "r")).read_all()
+        elif extension == FORMATS["parquet"]:
+            tables[table_name] = pq.read_table(file_path, memory_map=True)
+
+    return tables
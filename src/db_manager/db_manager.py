@@ -1,17 +1,59 @@
 import os
-from sqlalchemy import create_engine, inspect, text, func, update
-from sqlalchemy.orm import sessionmaker, Session, joinedload
+from sqlalchemy import create_engine, inspect, text, func, update, select, event
+from sqlalchemy.orm import sessionmaker, Session, joinedload, selectinload
 from sqlalchemy.exc import SQLAlchemyError
 import contextlib
+import threading
 from typing import Generator, Optional
+from datetime import timedelta
 
 from .models import Base, Camera, ParkingZone, ParkingZonePoint, datetime, timezone
+from . import columnar_export
+
+class OccupancyExceedsCapacity(Exception):
+    """occupied больше вместимости зоны"""
+
+class CameraTitleTaken(Exception):
+    """Камера с таким названием уже есть"""
+
+class CameraNotFound(Exception):
+    """Камеры, к которой привязывают зону, нет"""
+
+def _zone_bbox(points) -> dict:
+    return {
+        "min_latitude": min(point.latitude for point in points),
+        "max_latitude": max(point.latitude for point in points),
+        "min_longitude": min(point.longitude for point in points),
+        "max_longitude": max(point.longitude for point in points)
+    }
 
 class DBManager:
-    def __init__(self, database_url: str):
+    def __init__(
+            self, 
+            database_url: str, 
+            sqlite_tuned: bool = False,
+            sqlite_mmap_size: int = 256 * 1024 * 1024,
+            sqlite_busy_timeout_ms: int = 5000,
+            stale_after: Optional[timedelta] = None):
         self.database_url = database_url
+        # Через сколько без обновлений занятость зоны считается неизвестной
+        self.stale_after = stale_after
         self.engine = None
         self.SessionLocal = None
+
+        self.sqlite_tuned = sqlite_tuned and database_url.startswith("sqlite")
+        self.sqlite_mmap_size = sqlite_mmap_size
+        self.sqlite_busy_timeout_ms = sqlite_busy_timeout_ms
+        # SQLite пускает одного писателя, поэтому пишущие сессии встают в очередь здесь,
+        # а не ловят "database is locked"; читатели в WAL идут параллельно.
+        # Очередь блокирующая и упорядочивает только писателей из разных потоков,
+        # поэтому API вызывает запись через asyncio.to_thread
+        self._write_lock = threading.Lock() if self.sqlite_tuned else None
+        # Записи, которые сначала что-то проверяют (название камеры, камера зоны), идут
+        # по одной в любом режиме, иначе две параллельные проверки пройдут обе.
+        # Берется раньше _write_lock
+        self._checked_write_lock = threading.Lock()
+
         self._initialize_database()
 
         self.total_camera_count = None
@@ -39,6 +81,12 @@ class DBManager:
         else:
             self.camera_index += 1
 
+    def _stale_before(self) -> Optional[datetime]:
+        if self.stale_after is None:
+            return None
+
+        return datetime.now(timezone.utc) - self.stale_after
+
     def _initialize_database(self):
         """Инициализация движка и сессии"""
         try:
@@ -46,6 +94,9 @@ class DBManager:
             connect_args = {}
             if self.database_url.startswith("sqlite"):
                 connect_args = {"check_same_thread": False}
+
+                if self.sqlite_tuned:
+                    connect_args["timeout"] = self.sqlite_busy_timeout_ms / 1000
             
             self.engine = create_engine(
                 self.database_url,
@@ -53,6 +104,9 @@ class DBManager:
                 echo=True,  # Для тестирования
                 pool_pre_ping=True # Загадочно
             )
+
+            if self.sqlite_tuned:
+                event.listen(self.engine, "connect", self._tune_sqlite_connection)
             
             self.SessionLocal = sessionmaker(
                 autocommit=False,
@@ -63,6 +117,10 @@ class DBManager:
             if not self._check_tables_exist():
                 print(f"Gotta setup database real quick hold on...")
                 self._create_tables()
+            else:
+                self._ensure_columns()
+                self._ensure_indexes()
+                self._backfill_zone_bboxes()
             
             print(f"Database initialized successfully: {self.database_url}")
             
@@ -70,6 +128,16 @@ class DBManager:
             print(f"Database initialization failed: {e}")
             raise
 
+    def _tune_sqlite_connection(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA mmap_size={int(self.sqlite_mmap_size)}")
+            cursor.execute(f"PRAGMA busy_timeout={int(self.sqlite_busy_timeout_ms)}")
+        finally:
+            cursor.close()
+
     def _check_tables_exist(self) -> bool:
         try:
             inspector = inspect(self.engine)
@@ -102,6 +170,55 @@ class DBManager:
             print(f"Error creating tables: {e}")
             raise
 
+    def _ensure_columns(self):
+        """Досоздать колонки, добавленные в модели после создания таблиц"""
+        try:
+            inspector = inspect(self.engine)
+            with self.engine.begin() as connection:
+                for table in Base.metadata.sorted_tables:
+                    existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+                    for column in table.columns:
+                        if column.name not in existing_columns:
+                            print(f"Adding column {table.name}.{column.name}")
+                            connection.execute(text(
+                                f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                f"{column.type.compile(dialect=self.engine.dialect)}"))
+        except Exception as e:
+            print(f"Error adding columns: {e}")
+            raise
+
+    def _ensure_indexes(self):
+        """Досоздать индексы, добавленные в модели после создания таблиц"""
+        try:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=self.engine, checkfirst=True)
+        except Exception as e:
+            print(f"Error creating indexes: {e}")
+            raise
+
+    def _backfill_zone_bboxes(self):
+        """Посчитать bbox зонам, созданным до появления колонок bbox"""
+        try:
+            def aggregate(function, column):
+                return select(function(column)).where(
+                    ParkingZonePoint.parking_zone_id == ParkingZone.id
+                ).scalar_subquery()
+
+            with self.engine.begin() as connection:
+                connection.execute(
+                    update(ParkingZone)
+                    .where(ParkingZone.min_latitude.is_(None))
+                    .values(
+                        min_latitude=aggregate(func.min, ParkingZonePoint.latitude),
+                        max_latitude=aggregate(func.max, ParkingZonePoint.latitude),
+                        min_longitude=aggregate(func.min, ParkingZonePoint.longitude),
+                        max_longitude=aggregate(func.max, ParkingZonePoint.longitude))
+                )
+        except Exception as e:
+            print(f"Error filling zone bboxes: {e}")
+            raise
+
     @contextlib.contextmanager
     def get_session(self) -> Generator[Session, None, None]:
         """Контекстный менеджер для получения сессии"""
@@ -115,6 +232,17 @@ class DBManager:
         finally:
             session.close()
 
+    @contextlib.contextmanager
+    def get_write_session(self, checked: bool = False) -> Generator[Session, None, None]:
+        """Сессия для записи, в SQLite режиме писатели выполняются по одному
+
+        checked - запись с проверкой внутри сессии, такие сериализуются всегда
+        """
+        with self._checked_write_lock if checked else contextlib.nullcontext():
+            with self._write_lock or contextlib.nullcontext():
+                with self.get_session() as session:
+                    yield session
+
     def check_connection(self) -> bool:
         """Проверить соединение с базой данных"""
         try:
@@ -134,20 +262,21 @@ class DBManager:
             result = session.execute(query, params or {})
             return result
         
-    def camera_title_already_exists(self, title) -> bool:
-        with self.get_session() as session:
-            query_result = session.query(Camera).filter(Camera.title.ilike(title))
+    def _camera_title_already_exists(self, session: Session, title) -> bool:
+        query_result = session.query(Camera).filter(Camera.title.ilike(title))
 
-            return session.query(query_result.exists()).scalar()
+        return session.query(query_result.exists()).scalar()
         
-    def camera_id_exists(self, id) -> bool:
-        with self.get_session() as session:
-            query_result = session.query(Camera).filter(Camera.id == id)
+    def _camera_id_exists(self, session: Session, id) -> bool:
+        query_result = session.query(Camera).filter(Camera.id == id)
 
-            return session.query(query_result.exists()).scalar()
+        return session.query(query_result.exists()).scalar()
         
     def create_camera(self, camera):
-        with self.get_session() as session:
+        with self.get_write_session(checked=True) as session:
+            if self._camera_title_already_exists(session, camera['title']):
+                raise CameraTitleTaken(f"Camera with title '{camera['title']}' already exists")
+
             new_camera = Camera(
                 title=camera['title'],
                 latitude=camera['latitude'],
@@ -165,12 +294,16 @@ class DBManager:
             return new_camera.id
         
     def create_zone(self, zone):
-        with self.get_session() as session:
+        with self.get_write_session(checked=True) as session:
+            if not self._camera_id_exists(session, zone['camera_id']):
+                raise CameraNotFound(f"Camera with id {zone['camera_id']} doesn't exist")
+
             new_zone = ParkingZone(
                 zone_type=zone['zone_type'],
                 parking_lots_count=zone['parking_lots_count'],
                 camera_id=zone['camera_id'],
-                pay=zone['pay']
+                pay=zone['pay'],
+                **_zone_bbox(zone['points'])
             )
 
             session.add(new_zone)
@@ -200,7 +333,7 @@ class DBManager:
 
             zone = query.filter(ParkingZone.id == zone_id).one_or_none()
 
-            return zone.serialize() if zone is not None else zone
+            return zone.serialize(self._stale_before()) if zone is not None else zone
     
     def get_all_zones(self, camera_id, min_free_count, max_pay):
         with self.get_session() as session:
@@ -209,13 +342,34 @@ class DBManager:
             if camera_id is not None:
                 query = query.filter(ParkingZone.camera_id == camera_id)
             
+            stale_before = self._stale_before()
+
             if min_free_count is not None and min_free_count > 0:
                 query = query.filter(ParkingZone.parking_lots_count - ParkingZone.occupied >= min_free_count)
 
+                # Про зоны с устаревшей занятостью неизвестно, есть ли там места
+                if stale_before is not None:
+                    query = query.filter(ParkingZone.occupancy_updated_at >= stale_before)
+
             if max_pay is not None:
                 query = query.filter(ParkingZone.pay <= max_pay)
 
-            return [zone.serialize() for zone in query.all()]
+            return [zone.serialize(stale_before) for zone in query.all()]
+        
+    def get_zones_in_bbox(self, south, west, north, east):
+        """Зоны, чей bbox пересекается с прямоугольником"""
+        with self.get_session() as session:
+            query = session.query(ParkingZone).options(
+                selectinload(ParkingZone.points)
+            ).filter(
+                ParkingZone.min_latitude <= north,
+                ParkingZone.max_latitude >= south,
+                ParkingZone.min_longitude <= east,
+                ParkingZone.max_longitude >= west)
+
+            stale_before = self._stale_before()
+
+            return [zone.serialize(stale_before) for zone in query.all()]
         
     def get_all_cameras(
             self, 
@@ -244,13 +398,46 @@ class DBManager:
 
             return [camera.serialize() for camera in query.all()]
 
+    def next_camera_id(self) -> int:
+        camera_id = self.camera_index
+
+        self._next_camera()
+
+        return camera_id
+
     def get_most_outdated_camera(self, limit: int = 1):
         with self.get_session() as session:
-            camera = session.query(Camera).filter(Camera.id == self.camera_index).one_or_none()
-
-            self._next_camera()
+            camera = session.query(Camera).filter(Camera.id == self.next_camera_id()).one_or_none()
 
             return camera.serialize() if camera is not None else {}
+
+    def get_camera_work_package(self, camera_id):
+        """Метаданные камеры и геометрия ее зон - все, что нужно детектору"""
+        with self.get_session() as session:
+            camera = session.query(Camera).filter(Camera.id == camera_id).one_or_none()
+
+            if camera is None:
+                return None
+
+            zones = session.query(ParkingZone).options(
+                selectinload(ParkingZone.points)
+            ).filter(ParkingZone.camera_id == camera_id).order_by(ParkingZone.id).all()
+
+            return {
+                "camera": camera.serialize_metadata_only(),
+                "zones": [
+                    {
+                        "zone_id": zone.id,
+                        "zone_type": zone.zone_type,
+                        "capacity": zone.parking_lots_count,
+                        "points": [
+                            point.serialize() 
+                            for point in sorted(zone.points, key=lambda point: point.id)
+                        ]
+                    }
+                    for zone in zones
+                ]
+            }
         
     def get_camera(self, camera_id):
         with self.get_session() as session:
@@ -258,34 +445,169 @@ class DBManager:
 
             return camera.serialize()
 
-    def update_camera(self, camera_id, updated_fields):
-        with self.get_session() as session:
-            stmt = update(Camera).where(Camera.id == camera_id)
+    def _update_returning(self, session: Session, model, row_id: int, values: dict, *conditions):
+        """UPDATE ... RETURNING одной командой, для БД без RETURNING - UPDATE + SELECT
 
-            stmt = stmt.values(updated_fields)
-            print(updated_fields)
+        conditions - дополнительные условия WHERE, если они не выполнены, строка не обновляется
+        и возвращается None, как для несуществующей строки.
+        """
+        query = session.query(model).filter(model.id == row_id, *conditions)
 
-            session.execute(stmt)
+        if not values:
+            return query.one_or_none()
 
-            session.commit()
+        stmt = update(model).where(model.id == row_id, *conditions).values(values)
+        execution_options = {"synchronize_session": False}
 
-            camera = session.query(Camera).filter(Camera.id == camera_id).one_or_none()
+        if self.engine.dialect.update_returning:
+            return session.execute(
+                stmt.returning(model), 
+                execution_options=execution_options
+            ).scalar_one_or_none()
 
-            return camera.serialize()
+        # SQLite < 3.35 не поддерживает RETURNING
+        if session.execute(stmt, execution_options=execution_options).rowcount == 0:
+            return None
+
+        return query.one_or_none()
+
+    def update_camera(self, camera_id, updated_fields):
+        # Оператор сам решил, включена ли камера, sweeper ее больше не трогает
+        if "is_active" in updated_fields:
+            updated_fields = updated_fields | {"deactivated_by_sweeper": False}
+
+        with self.get_write_session() as session:
+            camera = self._update_returning(session, Camera, camera_id, updated_fields)
+
+            return camera.serialize() if camera is not None else None
         
     def update_zone(self, zone_id, updated_fields):
-        with self.get_session() as session:
-            stmt = update(ParkingZone).where(ParkingZone.id == zone_id)
+        updated_fields = dict(updated_fields)
+        points = updated_fields.pop("points", None)
 
-            stmt = stmt.values(
-                updated_fields | {"updated_at": datetime.now(timezone.utc)}
-                    if "occupied" not in updated_fields else 
-                updated_fields | {"occupancy_updated_at": datetime.now(timezone.utc)})
-            
-            session.execute(stmt)
+        if points is not None:
+            updated_fields |= _zone_bbox(points)
 
-            session.commit()
+        # Вместимость из того же запроса проверяет модель, иначе сравниваем с той, что в БД
+        conditions = []
+        if "occupied" in updated_fields and "parking_lots_count" not in updated_fields:
+            conditions.append(ParkingZone.parking_lots_count >= updated_fields["occupied"])
 
-            zone = session.query(ParkingZone).filter(ParkingZone.id == zone_id).one_or_none()
+        with self.get_write_session(checked="camera_id" in updated_fields) as session:
+            if "camera_id" in updated_fields and not self._camera_id_exists(session, updated_fields["camera_id"]):
+                raise CameraNotFound(f"Camera with id {updated_fields['camera_id']} doesn't exist")
 
-            return zone.serialize()
\ No newline at end of file
+            zone = self._update_returning(
+                session,
+                ParkingZone,
+                zone_id,
+                updated_fields | {"updated_at": datetime.now(timezone.utc)}
+                    if "occupied" not in updated_fields else 
+                updated_fields | {"occupancy_updated_at": datetime.now(timezone.utc)},
+                *conditions)
+
+            if zone is None:
+                if conditions and session.get(ParkingZone, zone_id) is not None:
+                    raise OccupancyExceedsCapacity(
+                        f"occupied ({updated_fields['occupied']}) exceeds capacity of zone {zone_id}")
+
+                return None
+
+            if points is not None:
+                session.query(ParkingZonePoint).filter(
+                    ParkingZonePoint.parking_zone_id == zone_id
+                ).delete(synchronize_session=False)
+
+                session.add_all([
+                    ParkingZonePoint(
+                        parking_zone_id=zone_id, 
+                        x=point.x,
+                        y=point.y,
+                        latitude=point.latitude,
+                        longitude=point.longitude)
+                    for point in points
+                ])
+
+                session.flush()
+
+            return zone.serialize(self._stale_before())
+        
+    def check_columnar_export(self, format: str = "arrow"):
+        columnar_export.check_export_support(format)
+
+        # Выгрузка держит транзакцию чтения до конца; в SQLite без WAL все это время
+        # писатели получали бы "database is locked"
+        if self.database_url.startswith("sqlite") and not self.sqlite_tuned:
+            raise ValueError("Columnar export on SQLite requires SQLITE_TUNED (WAL journal)")
+
+    def export_columnar_snapshot(self, directory: str, format: str = "arrow", batch_size: int = 50000) -> str:
+        """Снапшот зон, точек и занятости в Arrow IPC / Parquet для аналитики"""
+        self.check_columnar_export(format)
+
+        return columnar_export.export_snapshot(self.engine, directory, format, batch_size)
+
+    def sweep_stale_zones(self, since: Optional[datetime] = None, batch_size: int = 1000):
+        """Найти зоны, ставшие устаревшими, и выключить камеры без свежих данных
+
+        Обратно включаются только камеры, которые выключил sweeper.
+
+        Сами измерения не трогаются: "неизвестно" вычисляется при сериализации,
+        а найденные зоны нужны, чтобы сбросить закэшированные ответы с ними.
+        since - cutoff предыдущего прохода: зоны старше него уже найдены раньше,
+        поэтому просматривается только диапазон индекса [since, cutoff).
+        """
+        cutoff = self._stale_before()
+
+        stale_filter = [
+            ParkingZone.occupancy_updated_at < cutoff,
+            ParkingZone.occupied.is_not(None)
+        ]
+        if since is not None:
+            stale_filter.append(ParkingZone.occupancy_updated_at >= since)
+
+        stale_zone_ids = []
+        last_id = 0
+        while True:
+            with self.get_session() as session:
+                batch = session.execute(
+                    select(ParkingZone.id)
+                    .where(*stale_filter, ParkingZone.id > last_id)
+                    .order_by(ParkingZone.id)
+                    .limit(batch_size)
+                ).scalars().all()
+
+            stale_zone_ids.extend(batch)
+
+            if len(batch) < batch_size:
+                break
+
+            last_id = batch[-1]
+
+        with self.get_write_session() as session:
+            fresh_cameras = select(ParkingZone.camera_id).where(ParkingZone.occupancy_updated_at >= cutoff)
+            stale_cameras = select(ParkingZone.camera_id).where(ParkingZone.occupancy_updated_at < cutoff)
+
+            deactivated = session.execute(
+                update(Camera)
+                .where(
+                    Camera.is_active.is_(True),
+                    Camera.id.in_(stale_cameras),
+                    Camera.id.not_in(fresh_cameras))
+                .values(is_active=False, deactivated_by_sweeper=True)
+            ).rowcount
+
+            reactivated = session.execute(
+                update(Camera)
+                .where(
+                    Camera.is_active.is_(False), 
+                    Camera.deactivated_by_sweeper.is_(True),
+                    Camera.id.in_(fresh_cameras))
+                .values(is_active=True, deactivated_by_sweeper=False)
+            ).rowcount
+
+        return {
+            "cutoff": cutoff,
+            "stale_zone_ids": stale_zone_ids,
+            "deactivated_cameras": deactivated,
+            "reactivated_cameras": reactivated
+        }
\ No newline at end of file
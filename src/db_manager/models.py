@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Numeric, ForeignKey, Float, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Numeric, ForeignKey, Float, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
+from typing import Optional
 
 Base = declarative_base()
 
@@ -11,6 +12,8 @@ class Camera(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String(120))
     is_active = Column(Boolean, default=True)
+    # Камеру выключил sweeper, а не оператор - только такие он включает обратно
+    deactivated_by_sweeper = Column(Boolean, default=False)
     source = Column(String(250))
     image_height = Column(Integer, default=0)
     image_width = Column(Integer, default=0)
@@ -52,17 +55,26 @@ class Camera(Base):
 
 class ParkingZone(Base):
     __tablename__ = 'parking_zones'
+    __table_args__ = (
+        # Для выборки зон, пересекающих тайл
+        Index('ix_parking_zones_bbox', 'min_latitude', 'min_longitude', 'max_latitude', 'max_longitude'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     zone_type = Column(String(50))
     parking_lots_count = Column(Integer)
-    camera_id = Column(Integer, ForeignKey('cameras.id'))
+    camera_id = Column(Integer, ForeignKey('cameras.id'), index=True)
     occupied = Column(Integer, default=None)
     confidence = Column(Float(precision=6), default=None)
     pay = Column(Integer)
-    occupancy_updated_at = Column(DateTime, default=None)
+    occupancy_updated_at = Column(DateTime, default=None, index=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # bbox точек зоны, поддерживается при создании зоны и замене точек
+    min_latitude = Column(Float, default=None)
+    max_latitude = Column(Float, default=None)
+    min_longitude = Column(Float, default=None)
+    max_longitude = Column(Float, default=None)
     
     camera = relationship("Camera", back_populates="parking_zones")
     points = relationship("ParkingZonePoint", back_populates="parking_zone")
@@ -70,14 +82,36 @@ class ParkingZone(Base):
     def __repr__(self):
         return f"<ParkingZone(id={self.id}, zone_type='{self.zone_type}', camera_id={self.camera_id})>"
     
-    def serialize(self):
+    def occupancy_is_known(self, stale_before: Optional[datetime] = None) -> bool:
+        """Есть ли занятость, обновленная не раньше stale_before"""
+        if self.occupied is None:
+            return False
+
+        if stale_before is None:
+            return True
+
+        if self.occupancy_updated_at is None:
+            return False
+
+        # В БД время хранится без таймзоны, в UTC
+        updated_at = self.occupancy_updated_at
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+
+        return updated_at >= stale_before
+
+    def serialize(self, stale_before: Optional[datetime] = None):
+        # Устаревшая занятость в ответе - неизвестна, в таблице измерение остается как есть
+        known = self.occupancy_is_known(stale_before)
+
         data = {
             "zone_id": self.id,
             "camera_id": self.camera_id,
             "zone_type": self.zone_type,
             "capacity": self.parking_lots_count,
-            "occupied": self.occupied,
-            "confidence": self.confidence,
+            "occupied": self.occupied if known else None,
+            "confidence": self.confidence if known else None,
+            "occupancy_status": "actual" if known else "unknown",
             "pay": self.pay,
             "occupancy_updated_at": self.occupancy_updated_at,
             "created_at": self.created_at,
@@ -92,7 +126,7 @@ class ParkingZonePoint(Base):
     __tablename__ = 'parking_zones_points'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    parking_zone_id = Column(Integer, ForeignKey('parking_zones.id'))
+    parking_zone_id = Column(Integer, ForeignKey('parking_zones.id'), index=True)
     x = Column(Integer)
     y = Column(Integer)
     latitude = Column(Numeric(11, 8))
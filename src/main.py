@@ -1,5 +1,6 @@
 from api.api import PublicAPI, URL
 from db_manager.db_manager import DBManager
+from datetime import timedelta
 import os
 
 from dotenv import load_dotenv
@@ -8,7 +9,19 @@ load_dotenv()
 
 def main():
     print(os.getenv("DB_CONNECTION_URL"), os.getenv("HOST"), os.getenv("PORT"))
-    api_server = PublicAPI(DBManager(os.getenv("DB_CONNECTION_URL")))
+    stale_after = os.getenv("STALE_AFTER_SECONDS")
+
+    api_server = PublicAPI(
+        DBManager(
+            os.getenv("DB_CONNECTION_URL"),
+            sqlite_tuned=os.getenv("SQLITE_TUNED", "").lower() in ("1", "true", "yes"),
+            stale_after=timedelta(seconds=int(stale_after)) if stale_after else None),
+        sweep_interval=timedelta(seconds=int(os.getenv("STALE_SWEEP_INTERVAL_SECONDS", "60"))),
+        profiling_token=os.getenv("PROFILING_TOKEN"),
+        profiling_dir=os.getenv("PROFILING_DIR", "profiles"),
+        export_dir=os.getenv("EXPORT_DIR"),
+        export_interval=timedelta(seconds=int(os.getenv("EXPORT_INTERVAL_SECONDS", "900"))),
+        export_format=os.getenv("EXPORT_FORMAT", "arrow"))
     api_server.run(URL(host=os.getenv("HOST"), port=os.getenv("PORT")))
 
 if __name__ == "__main__":